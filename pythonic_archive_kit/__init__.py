@@ -1,5 +1,5 @@
 """The Pythonic Archive Kit"""
-from .base import load_pak, open_pak, PAK, save_pak
+from .base import clear_password_cache, load_pak, open_pak, PAK, save_pak
 from .typing import TypedPAK
 from .utils import __VERSION_STR__ as __version__
 
@@ -7,4 +7,5 @@ __all__ = [
         "open_pak",
         "load_pak",
         "save_pak",
+        "clear_password_cache",
 ]
@@ -1,43 +1,209 @@
+import atexit
 import base64
+import builtins
+import concurrent.futures
 import contextlib
+import functools
 import hashlib
+import io
 import logging
+import os
 import pathlib
+import pickletools
+import struct
 import sys
+import threading
 import traceback
 import types
 from typing import MutableMapping
 
-from .libraries import cryptography, Fernet, is_picklable, open, pickle
+from .libraries import aead, codec, compress, decompress, digest_name, digests, fernet, is_picklable, open, pickle
 # the libraries module deals with the dynamic imports of the libraries used by PAK
-# this allows for optional behavior, such as using lzma compression, dill pickling, or cryptography encryption
-from .utils import __VERSION__ as PAK_VERSION
+# this allows for optional behavior, such as using zstd compression, dill pickling, or cryptography encryption
+from .utils import __VERSION__ as PAK_VERSION, _split_path, AttrPath
 
 logger = logging.getLogger(__name__)
 logger.addHandler(logging.StreamHandler())
 logger.setLevel(logging.INFO)
 
 
-def _hash_state(state):
-    """Generate a hash of the state of a PAK object."""
+_MAGIC = b"PAK"
+_HEADER = struct.Struct("<3s3BBB")
+# magic, pak version, length of the digest name, length of the digest
+# the header is followed by the digest name, the pickled PAK, and finally the digest of the pickle
+# the digest goes last so the pickle can be streamed out while it is hashed
+_FILE_MAGIC = b"PAKF"
+_FILE_HEADER = struct.Struct("<4sBB")
+# PAK files start with their own magic, the flags and the id of the codec the rest of the file is compressed with
+# so loading reads which layers to undo from the header, rather than sniffing the data
+_PICKLE_PROTO = b"\x80"
+# PAK 2 stored bare pickles, which start with the PROTO opcode rather than the PAK magic
+_LEGACY_CODECS = {b"\xfd7zXZ\x00": 2, b"\x1f\x8b": 1}
+_FERNET_TOKEN = b"g"
+# PAK 2 files had no header, their data was compressed with lzma, or gzip without it, then encrypted with Fernet,
+# whose tokens all start with the same base64 encoded version byte
+_COMPRESSED = 1
+_ENCRYPTED = 2
+_OPTIMIZED = 4
+_BUFFER_SIZE = 1 << 20
+_NONCE_SIZE = 12
+_ATOMIC_TYPES = frozenset((str, bytes, int, float, complex, bool, type(None)))
+# values of these exact types always pickle, and hold no other objects, so assigning them skips the picklability check
+_autoviv = threading.local()
+# how many no_autoviv contexts are open on each thread, missing names raise rather than create PAK objects while any are
+_swept = threading.local()
+# the PAK objects _dump swept before pickling on each thread, keyed by id, their reduces don't prune them again
+_legacy = threading.local()
+# how many PAK 2 pickles are being loaded on each thread, only their states carry a version and hash to check
+
+
+class _HashingWriter:
+    """Write through to a file, hashing the data on the way."""
+
+    def __init__(self, file, hasher):
+        self.file = file
+        self.hasher = hasher
+
+    def write(self, data):
+        self.hasher.update(data)
+        return self.file.write(data)
+
+
+def _dump(pak, file, optimize = False):
+    """Pickle a PAK object to a file, framed by a header holding the pak version and a trailing hash of the pickle.
+        If optimize is True, unused opcodes are stripped from the pickle, this makes it smaller at the cost of speed.
+    """
     logger.debug("Calculating hash of state")
-    return hashlib.sha256(str(state).encode()).hexdigest()
+    name = digest_name.encode()
+    hasher = digests[digest_name]()
+    file.write(_HEADER.pack(_MAGIC, *PAK_VERSION, len(name), hasher.digest_size))
+    file.write(name)
+    writer = _HashingWriter(file, hasher)
+    previous = getattr(_swept, "nodes", {})
+    _swept.nodes = _sweep(pak) if isinstance(pak, PAK) else {}
+    try:
+        if optimize:
+            writer.write(pickletools.optimize(pickle.dumps(pak, protocol = pickle.HIGHEST_PROTOCOL)))
+        else:
+            pickle.Pickler(writer, protocol = pickle.HIGHEST_PROTOCOL).dump(pak)
+    finally:
+        _swept.nodes = previous
+    file.write(hasher.digest())
+
+
+def _pack(pak, optimize = False):
+    """Pickle a PAK object to bytes, framed as by _dump."""
+    buffer = io.BytesIO()
+    _dump(pak, buffer, optimize)
+    return buffer.getvalue()
+
+
+def _unpack(data):
+    """Check the version and hash in the framing of packed PAK data, then unpickle it.
+        Data from PAK 2, a bare pickle with the version and hash in each state, is checked by PAK.__setstate__ instead.
+    """
+    view = memoryview(data)
+    if view[:1] == _PICKLE_PROTO:
+        return _unpack_legacy(view)
+    try:
+        magic, *version, name_size, digest_size = _HEADER.unpack_from(view)
+    except struct.error:
+        raise ValueError("Invalid PAK data") from None
+    offset = _HEADER.size + name_size
+    if magic != _MAGIC or len(view) < offset + digest_size:
+        raise ValueError("Invalid PAK data")
+    if tuple(version) < PAK_VERSION:
+        raise ValueError("Invalid version")
+    name = bytes(view[_HEADER.size:offset]).decode(errors = "replace")
+    if name not in digests:
+        raise ValueError(f"Unsupported hash {name}")
+    payload = view[offset:len(view) - digest_size]
+    if digests[name](payload).digest() != view[len(view) - digest_size:]:
+        raise ValueError("Invalid hash")
+    return pickle.loads(payload)
+
+
+def _unpack_legacy(data):
+    """Unpickle PAK 2 data, whose states are checked against the version and hash stored in them as they load."""
+    _legacy.depth = getattr(_legacy, "depth", 0) + 1
+    try:
+        pak = pickle.loads(data)
+    finally:
+        _legacy.depth -= 1
+    if not isinstance(pak, PAK):
+        raise ValueError("Invalid PAK data")
+    return pak
+
+
+def _check_legacy_state(state):
+    """Check the hash PAK 2 stored in a pickled state, returning the state without its version and hash."""
+    state = dict(state)
+    state.pop("__version__", None)
+    if state.pop("__hash__", None) != hashlib.sha256(str(state).encode()).hexdigest():
+        raise ValueError("Invalid hash")
+    return state
+
+
+def _hollow(pak):
+    """Check whether a PAK object holds nothing but, possibly nested, empty PAK objects."""
+    # walks every PAK object below until it finds another value, so each level of a long chain walks the rest of it
+    # a PAK object reached twice may be part of a cycle back to its parent, so it is kept rather than pruned
+    stack = [pak]
+    seen = set()
+    while stack:
+        node = stack.pop()
+        if id(node) in seen:
+            return False
+        seen.add(id(node))
+        for value in node.__dict__.values():
+            if not isinstance(value, PAK):
+                return False
+            stack.append(value)
+    return True
+
+
+def _prune(pak):
+    """Remove the direct children of a PAK object that hold nothing but empty PAK objects."""
+    # used when a PAK object is pickled directly, each nested PAK object prunes its own children as it is reduced,
+    # which is quadratic in the depth of a chain of PAK objects, saves and bytes sweep the tree first instead
+    for key in [k for k, v in pak.__dict__.items() if isinstance(v, PAK) and _hollow(v)]:
+        del pak.__dict__[key]
+    return pak
 
 
 def _sweep(pak):
-    """Remove empty PAK objects from a PAK object."""
+    """Remove empty PAK objects from a PAK object, however deeply nested, visiting each PAK object once.
+        Returns the PAK objects it visited keyed by id, pruned ones included, so their reduces can skip pruning.
+    """
     logger.debug("Sweeping PAK object")
-    for k, v in pak.__dict__.copy().items():
-        if isinstance(v, PAK):
-            _sweep(v)
-            if not v:
-                del pak.__dict__[k]
-    return pak
+    # each PAK object is pruned once all of its children are finished, so a shared child reached again is already
+    # as empty as it will get, and one still being walked is an ancestor, which holds the path back to it
+    nodes = {id(pak): pak}
+    stack = [(pak, iter(pak.__dict__.values()))]
+    while stack:
+        node, values = stack[-1]
+        for value in values:
+            if isinstance(value, PAK) and id(value) not in nodes:
+                nodes[id(value)] = value
+                stack.append((value, iter(value.__dict__.values())))
+                break
+        else:
+            stack.pop()
+            for key in [k for k, v in node.__dict__.items() if isinstance(v, PAK) and not v.__dict__]:
+                del node.__dict__[key]
+    return nodes
 
 
-def _fernet(password):
-    """Generate a Fernet object from a password."""
-    return Fernet(base64.urlsafe_b64encode(hashlib.sha256(password.encode()).digest()))
+@functools.lru_cache(maxsize = 32)
+def _cipher(password):
+    """Generate an AES-GCM cipher from a password, cached so repeated saves and loads don't re-derive the key."""
+    aesgcm, _ = aead()
+    return aesgcm(hashlib.sha256(password.encode()).digest())
+
+
+def clear_password_cache():
+    """Forget the ciphers derived from passwords used so far, so neither they nor their keys stay in memory."""
+    _cipher.cache_clear()
 
 
 def _pak_except_hook(exc_type, value, tb):
@@ -84,8 +250,8 @@ class PAK(types.SimpleNamespace, MutableMapping):
     It is a recursive namespace that can be pickled and encrypted.
     Because it is both a mutable mapping, and a namespace, it can be used like a dictionary, or like an object.
     These are both valid approaches and will modify the same underlying data structure.
-    During pickling, the paks state is hashed and a pak version is stored in the state.
-    If these don't match on unpickling, an error is raised.
+    When converted to bytes, the pickled state is hashed, and the hash and pak version are stored in a header.
+    If these don't match when loading from bytes, an error is raised.
     The idea is that this will help prevent unpickling of malicious or corrupted data, though it is not a guarantee.
     
     Example usage:
@@ -113,154 +279,424 @@ class PAK(types.SimpleNamespace, MutableMapping):
 
     def __getattr__(self, item):
         """If the attribute does not exist, create a new PAK object."""
-        logger.debug(f"Getting attribute {item} from PAK object")
-        return self.__dict__.setdefault(item, PAK())
+        if getattr(_autoviv, "depth", 0):
+            raise PAKAttributeError(f"Attribute {item} does not exist", item, None)
+        # new nodes are made by SimpleNamespace directly, skipping the bytes check in __new__ and the empty __init__
+        return self.__dict__.setdefault(item, types.SimpleNamespace.__new__(PAK))
+
+    def __getitem__(self, key):
+        """Get an item, creating a new PAK object only if it does not exist. Keys are never treated as paths."""
+        try:
+            return self.__dict__[key]
+        except KeyError:
+            if getattr(_autoviv, "depth", 0):
+                raise
+            return self.__getattr__(key)
         
     def __setattr__(self, key, value):
         """Set an attribute on the PAK object."""
-        logger.debug(f"Setting attribute {key} on PAK object")
-        if not is_picklable(value):
+        # PAK objects define their own pickling, so skip the check, with dill it round trips the whole subtree
+        if type(value) not in _ATOMIC_TYPES and not isinstance(value, PAK) and not is_picklable(value):
             raise PAKAssignmentError(f"Attribute {key} is not picklable with {type(value)}", key, value)
         self.__dict__[key] = value
             
     def __delattr__(self, item):
         """Delete an attribute from the PAK object."""
-        logger.debug(f"Deleting attribute {item} from PAK object")
         del self.__dict__[item]
                 
     def __reduce_ex__(self, protocol):
-        """Reduce the PAK object to a picklable state.
-            Injects the version and hash of the state into the state itself.
-        """
+        """Reduce the PAK object to a picklable state."""
         logger.debug("Reducing PAK object to a picklable state")
-        state = _sweep(self).__dict__.copy()
-        state.update(__hash__=_hash_state(state), __version__=PAK_VERSION)
-        return (PAK, (), state)
+        # the namespace itself is the state, pickle only reads it and __setstate__ copies it into the new object
+        if getattr(_swept, "nodes", {}).get(id(self)) is not self:
+            _prune(self)
+        return (PAK, (), self.__dict__)
 
     def __setstate__(self, state):
-        """Restore the PAK object from a pickled state.
-            Checks the version and hash of the state before restoring.
-        """
+        """Restore the PAK object from a pickled state."""
         logger.debug("Restoring PAK object from a pickled state")
-        if not all(a >= b for a, b in zip(state.pop("__version__"), PAK_VERSION)):
-            raise ValueError("Invalid version")
-        if state.pop("__hash__") != _hash_state(state):
-            raise ValueError("Invalid hash")
+        if getattr(_legacy, "depth", 0):
+            state = _check_legacy_state(state)
         self.__dict__.update(state)
 
     def __bytes__(self):
-        """Convert the PAK object to bytes."""
+        """Convert the PAK object to bytes, the version and hash are checked when converting back."""
         logger.debug("Converting PAK object to bytes")
-        return pickle.dumps(self)
+        return _pack(self)
 
     def __new__(cls, *args, **kwargs):
         """Create a new PAK object from bytes or kwargs."""
-        logger.debug("Creating a new PAK object")
         if args and isinstance(args[0], bytes):
-            return pickle.loads(args[0])
+            return _unpack(args[0])
         else:
             return super().__new__(cls)
 
+    @classmethod
+    def from_bytes(cls, data):
+        """Create an object of this class from the bytes of a PAK object, checking their version and hash first.
+            Unlike PAK(data) this takes any bytes-like object, such as a memoryview, and always returns this class,
+            so subclasses get their own type back rather than the PAK objects that were pickled.
+        """
+        pak = _unpack(data)
+        if isinstance(pak, cls):
+            return pak
+        obj = super().__new__(cls)
+        obj.__dict__.update(pak.__dict__)
+        return obj
+
     def __init__(self, *_, **kwargs):
-        super().__init__(**kwargs)
+        if kwargs:
+            super().__init__(**kwargs)
 
     def __contains__(self, key):
-        logger.debug(f"Checking if key {key} is in PAK object")
         return key in self.__dict__
 
     def __bool__(self):
-        logger.debug("Checking if PAK object is empty")
         return bool(self.__dict__)
 
     def __eq__(self, other):
+        if self is other:
+            return True
         if isinstance(other, PAK):
             return self.__dict__ == other.__dict__
         elif isinstance(other, dict):
             return self.__dict__ == other
         else:
-            return False
+            return NotImplemented
+
+    def __ne__(self, other):
+        # SimpleNamespace has its own __ne__, which would not agree with this __eq__ for dicts
+        if (result := self.__eq__(other)) is NotImplemented:
+            return result
+        return not result
 
     def __iter__(self):
-        logger.debug("Iterating over PAK object")
         return iter(self.__dict__)
 
     def __len__(self):
-        logger.debug("Getting the length of PAK object")
         return len(self.__dict__)
 
     def __repr__(self):
         return f"{self.__dict__!r}"
     
     def __str__(self):
-        def _str(pak, indent=0):
-            return "\n".join(
-                    f"{' ' * indent}{k}: {v}" if not isinstance(v, PAK) else f"{' ' * indent}{k}:\n{_str(v, indent + 4)}"
-                    for k, v in pak.__dict__.items()
-            )
-        return _str(self).strip()
+        # walk the tree with a stack of item iterators, so each line is built once and joined once at the end
+        lines = []
+        stack = [(iter(self.__dict__.items()), 0)]
+        while stack:
+            items, indent = stack[-1]
+            for k, v in items:
+                if isinstance(v, PAK):
+                    lines.append(f"{' ' * indent}{k}:")
+                    stack.append((iter(v.__dict__.items()), indent + 4))
+                    break
+                lines.append(f"{' ' * indent}{k}: {v}")
+            else:
+                stack.pop()
+        return "\n".join(lines).strip()
     
-    def __hash__(self):
-        return hash(self.__dict__)
+    # PAK objects are mutable, so like dicts they can't be hashed
+    __hash__ = None
 
     def setdefault(self, key, default):
-        logger.debug(f"Setting default value for key {key} in PAK object")
         return self.__dict__.setdefault(key, default)
 
-    __getitem__ = __getattr__
+    def update(self, other = (), /, **kwargs):
+        """Update the PAK object from a mapping, or iterable of key value pairs, and keyword arguments."""
+        self.__dict__.update(other, **kwargs)
+
+    def bulk_update(self, other):
+        """Update the PAK object from a nested mapping, dicts update the PAK objects at their keys, creating any needed.
+        >>> pak.bulk_update({"a": {"b": 1, "c": {"d": 2}}, "e": 3})
+        """
+        stack = [(self, other)]
+        while stack:
+            node, mapping = stack.pop()
+            namespace = node.__dict__
+            for k, v in mapping.items():
+                if isinstance(v, dict):
+                    if not isinstance(child := namespace.get(k), PAK):
+                        child = namespace[k] = types.SimpleNamespace.__new__(PAK)
+                    stack.append((child, v))
+                else:
+                    namespace[k] = v
+
+    @contextlib.contextmanager
+    def no_autoviv(self):
+        """Within the context, reading a missing name raises PAKAttributeError rather than creating a new PAK object.
+            This applies to every PAK object on the current thread, so nested objects behave the same way.
+        """
+        _autoviv.depth = getattr(_autoviv, "depth", 0) + 1
+        try:
+            yield self
+        finally:
+            _autoviv.depth -= 1
+
+    def flat(self):
+        """Iterate over the leaves of the PAK object as (dotted path, value) pairs, the inverse of bulk_set."""
+        # paths are carried as tuples and only joined once per leaf, keys set through update may not be strings
+        # a PAK object already on the path is a cycle back to it, so it is yielded as a value rather than walked again
+        stack = [(self, (), iter(self.__dict__.items()))]
+        on_path = {id(self)}
+        while stack:
+            _, prefix, items = stack[-1]
+            for k, v in items:
+                if isinstance(v, PAK) and id(v) not in on_path:
+                    stack.append((v, (*prefix, k), iter(v.__dict__.items())))
+                    on_path.add(id(v))
+                    break
+                yield ".".join(map(str, (*prefix, k))), v
+            else:
+                on_path.discard(id(stack.pop()[0]))
+
+    def get_path(self, path, default = None):
+        """Get the value at a dotted path, or default if it does not exist, see AttrPath.get."""
+        return AttrPath(path).get(self, default)
+
+    def set_path(self, path, value):
+        """Set the value at a dotted path, creating branches as needed, see AttrPath.set."""
+        return AttrPath(path).set(self, value)
+
+    def bulk_set(self, items):
+        """Set many dotted paths at once, as AttrPath.set would, walking each shared branch only once.
+        >>> pak.bulk_set({"a.b.c": 1, "a.b.d": 2, "e": 3})
+        """
+        nodes = {(): self}
+
+        def branch(path):
+            if (node := nodes.get(path)) is None:
+                node = nodes[path] = getattr(branch(path[:-1]), path[-1])
+            return node
+
+        for path, value in items.items():
+            branches, leaf = _split_path(path)
+            setattr(branch(branches), leaf, value)
+            if (key := (*branches, leaf)) in nodes:
+                # the branch was replaced, so later paths through it must walk the new value, as AttrPath.set would
+                for stale in [node for node in nodes if node[:len(key)] == key]:
+                    del nodes[stale]
+
+    def get(self, key, default = None):
+        """Get a value without creating a new PAK object if the key does not exist."""
+        return self.__dict__.get(key, default)
+
+    def pop(self, key, *default):
+        """Pop a value without creating a new PAK object if the key does not exist."""
+        return self.__dict__.pop(key, *default)
+
     __setitem__ = types.SimpleNamespace.__setattr__
     __delitem__ = types.SimpleNamespace.__delattr__
 
 
-def save_pak(data, path, /, password = None):
-    """Save a PAK file to disk."""
+_save_executor = concurrent.futures.ThreadPoolExecutor(thread_name_prefix = "pak-save")
+# compression and hashing release the GIL, so background saves of different files are written in parallel
+_pending = {}
+_pending_lock = threading.Lock()
+# background saves that have been queued, keyed by path, so later loads and saves of the same file wait on them
+# a save that succeeded drops out once it is done, a failed one is kept until the next load or save of its path raises it
+atexit.register(_save_executor.shutdown, wait = True)
+
+
+def _pak_path(path):
+    """Resolve a path to a PAK file, adding the .pak suffix if there is none."""
     path = pathlib.Path(path)
     if not path.suffix:
         path = path.with_suffix(".pak")
+    return path.resolve()
+
+
+def _wait_pending(path):
+    """Wait for any queued background save of the path to finish, raising its error if it failed."""
+    with _pending_lock:
+        future = _pending.pop(path, None)
+    if future is not None:
+        future.result()
+
+
+def _write_after(previous, path, write, encrypted = False, level = None, optimized = False):
+    """Write a PAK file once the save queued before it for the same path has finished, whether or not it failed."""
+    # saves are queued in order, so the previous save has already been picked up by a worker and this can't deadlock
+    if previous is not None:
+        concurrent.futures.wait((previous,))
+    _write_pak(path, write, encrypted, level, optimized)
+
+
+def _save_done(path, future):
+    """Forget a background save once it succeeded, unless a later save of the same path was queued since."""
+    if (exc := future.exception()) is not None:
+        logger.error("Background save failed: %r", exc)
+        return
+    with _pending_lock:
+        if _pending.get(path) is future:
+            del _pending[path]
+
+
+def _encrypt(payload, password, level = None):
+    """Compress then encrypt packed PAK data, the random nonce is stored ahead of the ciphertext."""
+    # ciphertext doesn't compress, so the payload is compressed before it is encrypted, never after
+    payload = compress(payload, level = level)
+    nonce = os.urandom(_NONCE_SIZE)
+    return nonce + _cipher(password).encrypt(nonce, payload, None)
+
+
+def _decrypt(data, password):
+    """Decrypt data written by _encrypt, raises ValueError if the password is wrong or the data was modified.
+        The decrypted data is still compressed, with the codec named in the file header.
+    """
+    view = memoryview(data)
+    _, invalid_tag = aead()
+    try:
+        return _cipher(password).decrypt(view[:_NONCE_SIZE], view[_NONCE_SIZE:], None)
+    except invalid_tag:
+        raise ValueError("Invalid password")
+
+
+def _write_pak(path, write, encrypted = False, level = None, optimized = False):
+    """Atomically write a PAK file, write is called with the compressed stream to fill it.
+        Encrypted data was compressed before it was encrypted, so write is called with the file itself.
+        If optimized is True, the header records that the pickle was optimized, so open_pak pickles it the same way.
+    """
     path.parent.mkdir(parents = True, exist_ok = True)
-    with open(
-            path,
-            "wb",
-            preset = 9,
-    ) as f:
-        if password is None:
-            return f.write(bytes(data))
-        f.write(_fernet(password).encrypt(bytes(data)))
-        f.close()
+    # write to a temporary file and swap it in, so a failed save never leaves a truncated PAK behind
+    tmp = path.with_suffix(path.suffix + ".tmp")
+    try:
+        with builtins.open(tmp, "wb", buffering = _BUFFER_SIZE) as raw:
+            flags = (codec and _COMPRESSED) | (encrypted and _ENCRYPTED) | (optimized and _OPTIMIZED)
+            raw.write(_FILE_HEADER.pack(_FILE_MAGIC, flags, codec))
+            with contextlib.nullcontext(raw) if encrypted else open(raw, codec, level) as f:
+                write(f)
+            raw.flush()
+            os.fsync(raw.fileno())
+        os.replace(tmp, path)
+    except BaseException:
+        tmp.unlink(missing_ok = True)
+        raise
 
 
-def load_pak(path, /, password = None, create = True, _pak_type = PAK):
-    """Load a PAK file from disk. If create is True, a new PAK file will be created if one does not exist."""
-    path = pathlib.Path(path)
-    if not path.suffix:
-        path = path.with_suffix(".pak")
+def save_pak(data, path, /, password = None, optimize = False, level = None):
+    """Save a PAK file to disk. If optimize is True, the pickle is optimized before compression for a smaller file.
+        The level sets how hard the compressor works, in the range of whichever codec is in use, see libraries.codecs.
+    """
+    path = _pak_path(path)
+    _wait_pending(path)
+    if password is None:
+        # without encryption the pickle is streamed straight into the compressor, it is never held in memory whole
+        # AES-GCM encrypts the payload in one call, so encrypted saves build it in memory first
+        _write_pak(path, lambda f: _dump(data, f, optimize), level = level, optimized = optimize)
+    else:
+        _write_pak(
+                path, lambda f: f.write(_encrypt(_pack(data, optimize), password, level)), True, optimized = optimize
+        )
+
+
+def _read_pak(path, password = None):
+    """Read a PAK file, undoing the layers named in its header.
+        Returns the packed PAK data it holds, and whether its pickle was optimized when it was saved.
+    """
+    with builtins.open(path, "rb", buffering = _BUFFER_SIZE) as raw:
+        if hasattr(os, "posix_fadvise"):
+            # the file is read once from start to end, so let the kernel read ahead more aggressively
+            os.posix_fadvise(raw.fileno(), 0, 0, os.POSIX_FADV_SEQUENTIAL)
+        header = raw.read(_FILE_HEADER.size)
+        if not header.startswith(_FILE_MAGIC):
+            return _read_legacy(header + raw.read(), password), False
+        try:
+            magic, flags, file_codec = _FILE_HEADER.unpack(header)
+        except struct.error:
+            raise ValueError("Invalid PAK file") from None
+        if flags & _ENCRYPTED and password is None:
+            raise ValueError("Password required")
+        # unlike saving, loading is not streamed: the payload is read whole so its hash is checked first
+        data = raw.read()
+    if flags & _ENCRYPTED:
+        data = _decrypt(data, password)
+    return decompress(data, file_codec if flags & _COMPRESSED else 0), bool(flags & _OPTIMIZED)
+
+
+def _read_legacy(data, password = None):
+    """Read the data of a PAK 2 file, which has no header, so its layers are told apart by the bytes they start with."""
+    data = next((decompress(data, c) for m, c in _LEGACY_CODECS.items() if data.startswith(m)), data)
+    if data.startswith(_PICKLE_PROTO):
+        return data
+    if not data.startswith(_FERNET_TOKEN):
+        raise ValueError("Invalid PAK file")
+    if password is None:
+        raise ValueError("Password required")
+    cipher, invalid_token = fernet()
     try:
-        with open(
-                path,
-                "rb",
-        ) as f:
-            if password is None:
-                pak = _pak_type(f.read())
-            else:
-                pak = _pak_type(_fernet(password).decrypt(f.read()))
-            f.close()
+        return cipher(base64.urlsafe_b64encode(hashlib.sha256(password.encode()).digest())).decrypt(data)
+    except invalid_token:
+        raise ValueError("Invalid password") from None
+
+
+def _digest(data):
+    """Get the digest name and digest from the framing of packed PAK data, together they identify the pickle.
+        PAK 2 data has no framing, so it has no digest, and is always saved again in the current format.
+    """
+    if data[:1] == _PICKLE_PROTO:
+        return None
+    *_, name_size, digest_size = _HEADER.unpack_from(data)
+    return bytes(data[_HEADER.size:_HEADER.size + name_size]), bytes(data[len(data) - digest_size:])
+
+
+def _load(path, password = None, create = True, _pak_type = PAK):
+    """Load a PAK file, returning the PAK object, the digest of the data it was loaded from and whether it was optimized.
+        If create is True and the file does not exist, a new PAK object is returned with no digest.
+    """
+    path = _pak_path(path)
+    _wait_pending(path)
+    try:
+        packed, optimized = _read_pak(path, password)
     except FileNotFoundError:
-        if create:
-            pak = _pak_type()
-        else:
+        if not create:
             raise
-    except cryptography.fernet.InvalidToken:
-        raise ValueError("Invalid password")
+        return _pak_type(), None, False
+    return _pak_type.from_bytes(packed), _digest(packed), optimized
+
+
+def load_pak(path, /, password = None, create = True, _pak_type = PAK):
+    """Load a PAK file from disk. If create is True, a new PAK file will be created if one does not exist."""
+    pak, *_ = _load(path, password, create, _pak_type)
     return pak
 
 
 @contextlib.contextmanager
-def open_pak(path, /, password = None, create = True, _pak_type = PAK):
+def open_pak(path, /, password = None, create = True, _pak_type = PAK, background = False, level = None):
+    """Load a PAK file and save it again when the context exits, unless the PAK was left unchanged.
+        If background is True, the PAK is pickled on exit but compressed and written to disk on a background thread.
+        The level is the compression level used for the save, as with save_pak, a file saved optimized stays optimized.
+        Saves to the same file are kept in order, and loading the file waits for its queued save to finish.
+    """
+    path = _pak_path(path)
+    data, digest, optimized = _load(path, password, create, _pak_type)
     try:
-        yield (data := load_pak(path, password, create, _pak_type))
+        yield data
     except Exception:
         raise
     else:
-        save_pak(data, path, password)
+        # pickle once, the same way the file was, and write those bytes only if their digest changed
+        # pickling now also means changes made after the context exits don't leak into a background save
+        payload = _pack(data, optimized)
+        # the digest is taken over the pickle, so an unchanged PAK pickles to the same digest it was loaded with
+        # and its save is skipped, rather than compressing, encrypting and writing the same state again
+        if _digest(payload) == digest:
+            return
+        if password is None:
+            write, encrypted = (lambda f: f.write(payload)), False
+        else:
+            write, encrypted = (lambda f: f.write(_encrypt(payload, password, level))), True
+        if not background:
+            _wait_pending(path)
+            _write_pak(path, write, encrypted, level, optimized)
+            return
+        # nested contexts can queue several saves of one file, each waits on the one queued before it,
+        # so saves of the same file are written in order while saves of different files run in parallel
+        with _pending_lock:
+            future = _save_executor.submit(
+                    _write_after, _pending.get(path), path, write, encrypted, level, optimized
+            )
+            _pending[path] = future
+        future.add_done_callback(functools.partial(_save_done, path))
 
 
 sys.excepthook = _decorate_existing_except_hook(sys.excepthook)
@@ -1,25 +1,91 @@
+import collections
+import contextlib
+import functools
 
+# compression backends keyed by the id stored in the PAK file header, in order of preference
+# each is an opener wrapping a file in a compressing stream, and one shot compress and decompress functions
+# the opener and compress function take an optional level, defaulting to the one that backend is tuned for
+# saves stream into the compressor, loads read the file whole anyway, so they skip the file wrappers and their buffering
+# encrypted saves compress the payload in one call, as it has to be compressed ahead of the encryption
+# the first available backend is used for writing, reading uses whichever backend wrote the file
+# id 0 is reserved for uncompressed data, so files stay readable when no backend is available at all
+Codec = collections.namedtuple("Codec", ("open", "compress", "decompress"))
+codecs = {}
 try:
-    import lzma as zip
+    import zstandard
 
-    open = zip.open
-    compress = zip.compress
-    decompress = zip.decompress
+    # level 3 is zstd's own default, compression is spread over every core
+    # compressors aren't thread safe, so each stream gets its own for saves running alongside background saves
+    codecs[3] = Codec(
+        lambda file, level = 3: zstandard.open(
+                file, "wb", cctx = zstandard.ZstdCompressor(level = level, threads = -1), closefd = False
+        ),
+        lambda data, level = 3: zstandard.ZstdCompressor(level = level, threads = -1).compress(data),
+        # streamed frames don't record their size, which a decompressobj doesn't need
+        lambda data: zstandard.ZstdDecompressor().decompressobj().decompress(data),
+    )
 except ImportError:
+    pass
+try:
+    import lzma
+
+    # the default preset, 9 was several times slower for a file only a few percent smaller
+    codecs[2] = Codec(
+        lambda file, level = 6: lzma.open(file, "wb", preset = level),
+        lambda data, level = 6: lzma.compress(data, preset = level),
+        lzma.decompress,
+    )
+except ImportError:
+    pass
+try:
+    import gzip
+
+    codecs[1] = Codec(
+        lambda file, level = 6: gzip.open(file, "wb", compresslevel = level),
+        lambda data, level = 6: gzip.compress(data, compresslevel = level),
+        gzip.decompress,
+    )
+except ImportError:
+    pass
+codec = next(iter(codecs), 0)
+# the codec saves are written with is settled here, once, rather than picked again on every save
+
+
+def _codec(codec):
     try:
-        import gzip as zip
+        return codecs[codec]
+    except KeyError:
+        raise ValueError(f"Unsupported compression {codec}") from None
+
+
+def open(file, codec = codec, level = None):
+    """Wrap a binary file in a stream that compresses what is written with a codec, codec 0 writes data as is.
+        The level is passed to the codec as is, as each backend has its own range, None uses the codec's default.
+    """
+    if not codec:
+        return contextlib.nullcontext(file)
+    opener = _codec(codec).open
+    return opener(file) if level is None else opener(file, level)
+
+
+def compress(data, codec = codec, level = None):
+    """Compress data with a codec in one call, codec 0 returns the data as is. The level is used as by open."""
+    if not codec:
+        return data
+    compressor = _codec(codec).compress
+    return compressor(data) if level is None else compressor(data, level)
+
+
+def decompress(data, codec):
+    """Decompress data written by a codec in one call, codec 0 returns the data as is."""
+    if not codec:
+        return data
+    return _codec(codec).decompress(data)
 
-        open = zip.open
-        compress = zip.compress
-        decompress = zip.decompress
-    except ImportError:
-        open = __builtins__.open
-        compress = lambda x: x
-        decompress = lambda x: x
-        
 try:
     import dill as pickle
-    is_picklable = pickle.pickles
+    # check with the same protocol the data will be saved with, some objects only pickle with protocol 5
+    is_picklable = functools.partial(pickle.pickles, protocol = pickle.HIGHEST_PROTOCOL)
 except ImportError:
     import pickle
     def is_picklable(obj):
@@ -32,44 +98,70 @@ except ImportError:
                 hasattr(obj, method_name) for method_name in deserialize_method_names):
             return True
         try:
-            pickle.dumps(obj)
+            pickle.dumps(obj, protocol = pickle.HIGHEST_PROTOCOL)
         except Exception:
             return False
         else:
             return True
         
+import hashlib
+
+# the state hash only guards against corruption, the encryption layer handles authentication,
+# so a fast non-cryptographic digest is preferred when one is available
+# each entry is a hash constructor, taking optional initial data, whose objects support update and digest
+digests = {"blake2b": functools.partial(hashlib.blake2b, digest_size = 16)}
+digest_name = "blake2b"
 try:
-    import cryptography
-    from cryptography.fernet import Fernet
+    import blake3
+    # hashes large payloads across every core
+    digests["blake3"] = functools.partial(blake3.blake3, max_threads = blake3.blake3.AUTO)
+    digest_name = "blake3"
 except ImportError:
-    from types import SimpleNamespace
-    import base64
-    import warnings
+    pass
+try:
+    import xxhash
+    digests["xxh3_128"] = xxhash.xxh3_128
+    digest_name = "xxh3_128"
+except ImportError:
+    pass
+
+@functools.lru_cache(maxsize = None)
+def aead():
+    """Import the AES-GCM cipher and its InvalidTag error on first use, as cryptography is slow to import.
+        Only encrypted saves and loads need it, so PAKs that are never encrypted don't pay for the import.
+    """
+    try:
+        from cryptography.exceptions import InvalidTag
+        from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+    except ImportError:
+        import base64
+        import warnings
 
-    class Fernet:
-        # only provides obfuscation, not encryption, via the base64 module
-        def __init__(self, *args, **kwargs):
-            warnings.warn(
-                    "The cryptography module is not installed, so PAK will not be able to encrypt or decrypt data.\n"
-                    "to fix this, install the cryptography module with `pip install cryptography`.",
-                    RuntimeWarning
-            )
+        class AESGCM:
+            # only provides obfuscation, not encryption, via the base64 module
+            def __init__(self, *args, **kwargs):
+                warnings.warn(
+                        "The cryptography module is not installed, so PAK will not be able to encrypt or decrypt data.\n"
+                        "to fix this, install the cryptography module with `pip install cryptography`.",
+                        RuntimeWarning
+                )
 
-        def encrypt(self, *args, **kwargs):
-            return base64.b64encode(args[0].encode())
+            def encrypt(self, nonce, data, associated_data):
+                return base64.b64encode(data)
 
-        def decrypt(self, *args, **kwargs):
-            return base64.b64decode(args[0]).decode()
+            def decrypt(self, nonce, data, associated_data):
+                return base64.b64decode(data)
 
 
-    class InvalidToken(Exception):
-        ...
+        class InvalidTag(Exception):
+            ...
+    return AESGCM, InvalidTag
 
 
-    cryptography = SimpleNamespace(
-            fernet = SimpleNamespace(
-                    Fernet = Fernet,
-                    InvalidToken = InvalidToken,
-                    fake_module = True
-            )
-    )
+@functools.lru_cache(maxsize = None)
+def fernet():
+    """Import the Fernet cipher and its InvalidToken error, only needed to decrypt files written by PAK 2.
+        Unlike aead, there is no fallback: PAK 2 only wrote encrypted files with cryptography installed.
+    """
+    from cryptography.fernet import Fernet, InvalidToken
+    return Fernet, InvalidToken
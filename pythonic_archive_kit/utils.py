@@ -1,11 +1,31 @@
 import functools
+import types
 from collections import UserString
 
-__VERSION_STR__ = ".".join(map(str, (__VERSION__ := (2, 0, 1))))
+__VERSION_STR__ = ".".join(map(str, (__VERSION__ := (3, 0, 0))))
+
+
+@functools.lru_cache(maxsize = 4096)
+def _split_path(path):
+    """Split a dotted path into its branches and leaf, cached as the same paths tend to be used repeatedly."""
+    *branches, leaf = path.split(".")
+    return tuple(branches), leaf
+
+
+_MISSING = object()
+
+
+def _probe(obj, name):
+    """Look up a name without side effects, namespaces such as PAK are probed through their dict so nothing is created."""
+    if isinstance(obj, types.SimpleNamespace):
+        return vars(obj).get(name, _MISSING)
+    return getattr(obj, name, _MISSING)
+
 
 class AttrPath(UserString):
     def __init__(self, path):
         super().__init__(path)
+        self._branches, self._leaf = _split_path(self.data)
         
     def __truediv__(self, other):
         return AttrPath(".".join((self.data, other)))
@@ -17,11 +37,16 @@ class AttrPath(UserString):
         return f"<AttrPath {self.data}>"
     
     def _do(self, obj, action, *args, **kwargs):
-        *branches, leaf = self.data.split(".")
-        return action(functools.reduce(getattr, branches, obj), leaf, *args, **kwargs)
+        for branch in self._branches:
+            obj = getattr(obj, branch)
+        return action(obj, self._leaf, *args, **kwargs)
     
     def get(self, obj, default = None):
-        return self._do(obj, getattr, default)
+        """Get the value at the path, or default if any part of it does not exist."""
+        for name in (*self._branches, self._leaf):
+            if (obj := _probe(obj, name)) is _MISSING:
+                return default
+        return obj
 
     def set(self, obj, value):
         return self._do(obj, setattr, value)